@@ -4,6 +4,8 @@ import json
 import logging
 import os
 import stat
+import threading
+from datetime import datetime
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -12,34 +14,65 @@ logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/analytics.readonly"]
 
+# In-process cache: Credentials per token path, reused while the token still
+# has at least this much life left (avoids re-reading/re-parsing token.json
+# and double-refreshing from concurrent batch threads)
+EXPIRY_SAFETY_MARGIN_SECONDS = 300
+_creds_cache: dict[str, Credentials] = {}
+_creds_lock = threading.Lock()
+
+
+def _seconds_until_expiry(creds: Credentials) -> float:
+    """Seconds until the access token expires (0 if expiry is unknown)."""
+    if not creds.expiry:
+        return 0.0
+    # google-auth stores expiry as naive UTC
+    return (creds.expiry - datetime.utcnow()).total_seconds()
+
 
 def load_credentials(token_path: str) -> Credentials:
     """Load and refresh OAuth2 credentials from a JSON token file.
 
-    Raises FileNotFoundError if the token file is missing (user must run
-    scripts/authenticate.py on the host first).
+    Repeated calls within one process return the cached Credentials object
+    until it nears expiry. Raises FileNotFoundError if the token file is
+    missing (user must run scripts/authenticate.py on the host first).
     """
-    if not os.path.exists(token_path):
-        raise FileNotFoundError(
-            f"Token file not found at {token_path}. "
-            "Run 'python scripts/authenticate.py' on the host to authenticate first."
-        )
+    with _creds_lock:
+        cached = _creds_cache.get(token_path)
+        if cached is not None and _seconds_until_expiry(cached) > EXPIRY_SAFETY_MARGIN_SECONDS:
+            return cached
+
+        if not os.path.exists(token_path):
+            raise FileNotFoundError(
+                f"Token file not found at {token_path}. "
+                "Run 'python scripts/authenticate.py' on the host to authenticate first."
+            )
 
-    creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
 
-    if creds.expired and creds.refresh_token:
-        logger.info("Token expired — refreshing")
-        creds.refresh(Request())
-        _save_token(creds, token_path)
+        # Refresh only when the token is missing, expired, or inside the
+        # safety margin; a token with comfortable life left (expiry is
+        # persisted in token.json) skips the refresh round trip entirely
+        remaining = _seconds_until_expiry(creds)
+        if remaining <= EXPIRY_SAFETY_MARGIN_SECONDS and creds.refresh_token:
+            logger.info("Token expires in %.0fs — refreshing", max(remaining, 0.0))
+            previous_refresh_token = creds.refresh_token
+            creds.refresh(Request())
+            if not creds.refresh_token and previous_refresh_token:
+                # Token endpoints may omit the refresh token from refresh
+                # responses; keep the one we already had
+                creds._refresh_token = previous_refresh_token
+            _save_token(creds, token_path)
 
-    if not creds.valid:
-        raise RuntimeError(
-            "Credentials are invalid and cannot be refreshed. "
-            "Re-run 'python scripts/authenticate.py' on the host."
-        )
+        if not creds.valid:
+            raise RuntimeError(
+                "Credentials are invalid and cannot be refreshed. "
+                "Re-run 'python scripts/authenticate.py' on the host."
+            )
 
-    logger.info("Credentials loaded successfully")
-    return creds
+        _creds_cache[token_path] = creds
+        logger.info("Credentials loaded successfully")
+        return creds
 
 
 def _save_token(creds: Credentials, path: str) -> None:
@@ -52,6 +85,10 @@ def _save_token(creds: Credentials, path: str) -> None:
         "client_secret": creds.client_secret,
         "scopes": list(creds.scopes or []),
     }
+    if creds.expiry:
+        # Persisting expiry lets later cold starts skip the refresh round
+        # trip while the token still has life left
+        token_data["expiry"] = creds.expiry.isoformat() + "Z"
     with open(path, "w") as f:
         json.dump(token_data, f, indent=2)
     os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)  # 0o600
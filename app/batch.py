@@ -12,20 +12,27 @@ import json
 import logging
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta
 from pathlib import Path
 
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.api_core.exceptions import (
-    DeadlineExceeded,
-    ResourceExhausted,
-    ServiceUnavailable,
-)
+from google.api_core.exceptions import ResourceExhausted
 
 from app import db
 from app.auth import load_credentials
-from app.report import chunk_metrics, run_report
+from app.report import (
+    MAX_DATE_RANGES_PER_REQUEST,
+    MAX_REQUESTS_PER_BATCH,
+    DailyQuotaExceeded,
+    build_dimension_filter,
+    build_report_request,
+    chunk_metrics,
+    get_client,
+    get_quota_remaining,
+    run_report_batch,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,19 +40,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Rate limiting: GA4 API has quotas per property per day
+# Rate limiting: fallback delay used until a response reports the property's
+# remaining hourly quota tokens; after that the delay is paced from quota
+# headroom, and ResourceExhausted errors double the property's penalty (AIMD)
 REQUEST_DELAY_SECONDS = 1.0
+QUOTA_LOG_EVERY_N_CALLS = 25
 
-# Retry config for transient API errors
-MAX_RETRIES = 3
-RETRY_BACKOFF_BASE = 2
-RETRYABLE_EXCEPTIONS = (
-    ResourceExhausted,
-    ServiceUnavailable,
-    DeadlineExceeded,
-    ConnectionError,
-    TimeoutError,
-)
+# Bounded fan-out: overall worker cap (overridable via "max_concurrency" in
+# batch_config.json) plus a per-property cap to stay under GA4's concurrent
+# request limit (~10 per property)
+DEFAULT_MAX_CONCURRENCY = 4
+PER_PROPERTY_CONCURRENCY = 8
 
 _MONTH_ABBR = {
     "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
@@ -89,27 +94,6 @@ def generate_date_ranges(
     return ranges
 
 
-def _run_report_with_retry(**kwargs) -> list[dict]:
-    """Wrap run_report() with retries for transient API errors."""
-    for attempt in range(MAX_RETRIES + 1):
-        try:
-            return run_report(**kwargs)
-        except RETRYABLE_EXCEPTIONS as exc:
-            if attempt == MAX_RETRIES:
-                raise
-            wait = RETRY_BACKOFF_BASE ** (attempt + 1)
-            logger.warning(
-                "    RETRY %d/%d after %s: %s (waiting %ds)",
-                attempt + 1,
-                MAX_RETRIES,
-                type(exc).__name__,
-                exc,
-                wait,
-            )
-            time.sleep(wait)
-    return []  # unreachable, satisfies type checker
-
-
 def load_batch_config(config_path: str) -> dict:
     """Load and validate batch_config.json.
 
@@ -162,7 +146,7 @@ def load_batch_config(config_path: str) -> dict:
 
 def run_batch(config: dict, creds) -> None:
     """Execute all brand x date-range x report-type combinations."""
-    client = BetaAnalyticsDataClient(credentials=creds)
+    client = get_client(creds)
     output_dir = Path(os.environ.get("GA4_OUTPUT_DIR", "/app/output")) / "batch"
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -171,22 +155,53 @@ def run_batch(config: dict, creds) -> None:
     date_ranges = config["date_ranges"]
     reports = config["reports"]
 
+    max_concurrency = int(config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    property_semaphores = {
+        b["property_id"]: threading.Semaphore(PER_PROPERTY_CONCURRENCY)
+        for b in brands
+    }
+
     total_queries = 0
     errors: list[str] = []
     csv_paths: dict[str, Path] = {}
 
+    # Properties whose daily quota ran out mid-run; skipped for the rest of
+    # the run since retrying cannot succeed until the quota resets.
+    exhausted_properties: set[str] = set()
+
+    # Per-property penalty delay, doubled on each ResourceExhausted (AIMD)
+    property_delays: dict[str, float] = {b["property_id"]: 0.0 for b in brands}
+
+    def _next_delay(property_id: str, rtt: float) -> float:
+        """Pace a property's calls from its remaining hourly quota tokens.
+
+        Spreads the remaining tokens over the hour, crediting time already
+        spent in the call itself. Falls back to REQUEST_DELAY_SECONDS until
+        the first response has reported quota.
+        """
+        remaining = get_quota_remaining(property_id)
+        if not remaining or remaining <= 0:
+            return max(property_delays[property_id], REQUEST_DELAY_SECONDS)
+        paced = max(0.0, (3600.0 / remaining) - rtt)
+        return max(property_delays[property_id], paced)
+
     for report in reports:
         report_name = report["name"]
         dimensions = report.get("dimensions", [])
         all_metrics = report["metrics"]
         dim_filter = report.get("dimension_filter")
+        # The filter is constant for the whole report: build the proto once
+        # instead of per sub-request
+        dim_filter_expr = build_dimension_filter(dim_filter) if dim_filter else None
         metric_chunks = chunk_metrics(all_metrics)
+        if not metric_chunks:
+            logger.warning(
+                "Report '%s' has no metrics — emitting placeholder rows only",
+                report_name,
+            )
 
         csv_path = output_dir / f"{report_name}_{timestamp}.csv"
         fieldnames = ["brand_name", "property_id", "period"] + dimensions + all_metrics
-        csv_file = open(csv_path, "w", newline="")
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        writer.writeheader()
 
         logger.info("=" * 60)
         logger.info("REPORT: %s (%d brands x %d periods)", report_name, len(brands), len(date_ranges))
@@ -196,66 +211,180 @@ def run_batch(config: dict, creds) -> None:
             logger.info("  Filter: %s = %s", dim_filter["field"], dim_filter["value"])
         logger.info("=" * 60)
 
+        # Coalesce periods into multi-DateRange sub-requests (4 per request,
+        # the API limit), one per (range group, metric chunk) pair, then
+        # bundle pairs up to the batchRunReports limit so each bundle is one
+        # round trip. Chunk varies slowest so that in task order the first
+        # metric chunk always precedes the others for a given period — the
+        # aggregation below relies on this to seed rows without probing.
+        range_groups = [
+            date_ranges[i : i + MAX_DATE_RANGES_PER_REQUEST]
+            for i in range(0, len(date_ranges), MAX_DATE_RANGES_PER_REQUEST)
+        ]
+        pairs = [(group, chunk) for chunk in metric_chunks for group in range_groups]
+        tasks: list[tuple[dict, list[tuple[list[dict], list[str]]]]] = []
         for brand in brands:
-            brand_name = brand["name"]
-            property_id = brand["property_id"]
+            for start_idx in range(0, len(pairs), MAX_REQUESTS_PER_BATCH):
+                tasks.append((brand, pairs[start_idx : start_idx + MAX_REQUESTS_PER_BATCH]))
+
+        brand_period_rows: dict[tuple[str, str], dict[tuple, dict]] = {
+            (b["name"], dr["label"]): {} for b in brands for dr in date_ranges
+        }
 
-            for dr in date_ranges:
-                period_label = dr["label"]
-                start = dr["start_date"]
-                end = dr["end_date"]
-
-                logger.info("  %s | %s | %s -> %s", brand_name, period_label, start, end)
-
-                combined_rows: dict[str, dict] = {}
-
-                for chunk in metric_chunks:
-                    try:
-                        rows = _run_report_with_retry(
-                            credentials=creds,
-                            property_id=property_id,
-                            start_date=start,
-                            end_date=end,
-                            dimensions=dimensions,
-                            metrics=chunk,
-                            dimension_filter=dim_filter,
-                            client=client,
+        def _fetch_bundle(
+            brand: dict, bundle: list[tuple[list[dict], list[str]]]
+        ) -> list[list[dict]]:
+            """Run one batched call, gated by the property's semaphore."""
+            property_id = brand["property_id"]
+            if property_id in exhausted_properties:
+                raise DailyQuotaExceeded(property_id)
+            requests = [
+                build_report_request(
+                    property_id=property_id,
+                    date_ranges=group,
+                    dimensions=dimensions,
+                    metrics=chunk,
+                    dimension_filter=dim_filter_expr,
+                )
+                for group, chunk in bundle
+            ]
+            with property_semaphores[property_id]:
+                start_time = time.monotonic()
+                report_rows = run_report_batch(
+                    client=client,
+                    property_id=property_id,
+                    requests=requests,
+                )
+                rtt = time.monotonic() - start_time
+                delay = _next_delay(property_id, rtt)
+                if delay > 0:
+                    time.sleep(delay)
+            return report_rows
+
+        # Raw sub-report rows per task, aggregated in task order afterwards
+        results_by_task: list[list[list[dict]] | None] = [None] * len(tasks)
+
+        # Don't spawn more workers than there are bundles to run
+        workers = max(1, min(max_concurrency, len(tasks)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            future_tasks = {
+                pool.submit(_fetch_bundle, brand, bundle): task_idx
+                for task_idx, (brand, bundle) in enumerate(tasks)
+            }
+            for future in as_completed(future_tasks):
+                task_idx = future_tasks[future]
+                brand, bundle = tasks[task_idx]
+                brand_name = brand["name"]
+                property_id = brand["property_id"]
+
+                try:
+                    results_by_task[task_idx] = future.result()
+                except DailyQuotaExceeded:
+                    if property_id not in exhausted_properties:
+                        exhausted_properties.add(property_id)
+                        error_msg = (
+                            f"{brand_name} ({property_id}): daily quota exhausted, "
+                            "skipping remaining queries for this property"
                         )
-                        total_queries += 1
-
-                        for row in rows:
-                            dim_key = "|".join(row.get(d, "") for d in dimensions) if dimensions else "__total__"
-                            if dim_key not in combined_rows:
-                                combined_rows[dim_key] = {
-                                    "brand_name": brand_name,
-                                    "property_id": property_id,
-                                    "period": period_label,
-                                }
-                                for d in dimensions:
-                                    combined_rows[dim_key][d] = row.get(d, "")
-                            combined_rows[dim_key].update(
-                                {m: row[m] for m in chunk if m in row}
-                            )
-
-                        time.sleep(REQUEST_DELAY_SECONDS)
-
-                    except Exception as exc:
-                        error_msg = f"{brand_name} | {period_label} | {report_name}: {type(exc).__name__}: {exc}"
                         logger.error("    ERROR: %s", error_msg)
                         errors.append(error_msg)
-                        time.sleep(REQUEST_DELAY_SECONDS * 2)
+                    continue
+                except ResourceExhausted as exc:
+                    property_delays[property_id] = max(
+                        REQUEST_DELAY_SECONDS, property_delays[property_id] * 2
+                    )
+                    labels = ", ".join(dict.fromkeys(dr["label"] for group, _ in bundle for dr in group))
+                    error_msg = (
+                        f"{brand_name} | {labels} | {report_name}: quota exceeded "
+                        f"(delay now {property_delays[property_id]:.1f}s): {exc}"
+                    )
+                    logger.error("    ERROR: %s", error_msg)
+                    errors.append(error_msg)
+                    continue
+                except Exception as exc:
+                    labels = ", ".join(dict.fromkeys(dr["label"] for group, _ in bundle for dr in group))
+                    error_msg = f"{brand_name} | {labels} | {report_name}: {type(exc).__name__}: {exc}"
+                    logger.error("    ERROR: %s", error_msg)
+                    errors.append(error_msg)
+                    continue
+
+                total_queries += 1
+                if total_queries % QUOTA_LOG_EVERY_N_CALLS == 0:
+                    remaining = get_quota_remaining(property_id)
+                    if remaining is not None:
+                        logger.info(
+                            "  Quota headroom: property %s has %d hourly tokens left",
+                            property_id,
+                            remaining,
+                        )
 
-                if not combined_rows and not dimensions:
-                    combined_rows["__total__"] = {
-                        "brand_name": brand_name,
-                        "property_id": property_id,
-                        "period": period_label,
-                    }
+        # Aggregate in task order: the first metric chunk seeds each period's
+        # rows with a plain assignment (each dim_key appears once per chunk,
+        # so no membership probe is needed), and later chunks only update
+        # buckets that exist. Rows appearing solely in a later chunk are
+        # dropped — that means the seed chunk had no data for them.
+        seed_chunk = metric_chunks[0] if metric_chunks else None
+        for (brand, bundle), report_rows in zip(tasks, results_by_task):
+            if report_rows is None:
+                continue  # bundle failed or was skipped
+            brand_name = brand["name"]
+            property_id = brand["property_id"]
 
-                for row_data in combined_rows.values():
-                    writer.writerow(row_data)
+            for (group, chunk), rows in zip(bundle, report_rows):
+                # Single-range responses carry no dateRange column, so fall
+                # back to the group's only label
+                default_label = group[0]["label"]
+                if chunk is seed_chunk:
+                    for row in rows:
+                        period_label = row.pop("dateRange", default_label)
+                        combined_rows = brand_period_rows.get((brand_name, period_label))
+                        if combined_rows is None:
+                            continue  # range name not in config (shouldn't happen)
+                        # Tuple key: no per-row string join/allocation, and the
+                        # dimension values are reused to seed the row dict
+                        dim_key = tuple(row.get(d, "") for d in dimensions)
+                        combined_rows[dim_key] = {
+                            "brand_name": brand_name,
+                            "property_id": property_id,
+                            "period": period_label,
+                            **dict(zip(dimensions, dim_key)),
+                            **{m: row[m] for m in chunk if m in row},
+                        }
+                else:
+                    for row in rows:
+                        period_label = row.pop("dateRange", default_label)
+                        combined_rows = brand_period_rows.get((brand_name, period_label))
+                        if combined_rows is None:
+                            continue
+                        dim_key = tuple(row.get(d, "") for d in dimensions)
+                        bucket = combined_rows.get(dim_key)
+                        if bucket is not None:
+                            bucket.update((m, row[m]) for m in chunk if m in row)
+
+        # Write in config order (brand, then period) so output is deterministic
+        # regardless of completion order. csv.writer with pre-built value
+        # lists skips DictWriter's per-row fieldname lookup machinery; the
+        # 1 MiB buffer coalesces row writes into few syscalls.
+        with open(csv_path, "w", newline="", buffering=1 << 20, encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(fieldnames)
+            for brand in brands:
+                brand_name = brand["name"]
+                property_id = brand["property_id"]
+                for dr in date_ranges:
+                    combined_rows = brand_period_rows[(brand_name, dr["label"])]
+                    if not combined_rows and not dimensions:
+                        combined_rows[()] = {
+                            "brand_name": brand_name,
+                            "property_id": property_id,
+                            "period": dr["label"],
+                        }
+
+                    writer.writerows(
+                        [row.get(f, "") for f in fieldnames]
+                        for row in combined_rows.values()
+                    )
 
-        csv_file.close()
         csv_paths[report_name] = csv_path
         logger.info("Saved: %s", csv_path)
 
@@ -2,11 +2,15 @@
 
 import os
 import re
+from functools import cached_property
 
 from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 _DATE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2}|today|yesterday|\d+daysAgo)$")
+_NAME_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]*$")
+_PROP_ID_PATTERN = re.compile(r"\d+")
+_PREFIX_PATTERN = re.compile(r"[a-zA-Z0-9_\-]+")
 
 
 class Settings(BaseSettings):
@@ -34,7 +38,7 @@ class Settings(BaseSettings):
     @field_validator("property_id")
     @classmethod
     def validate_property_id(cls, v: str) -> str:
-        if not re.fullmatch(r"\d+", v):
+        if not _PROP_ID_PATTERN.fullmatch(v):
             raise ValueError(
                 f"GA4_PROPERTY_ID must be numeric, got '{v}'"
             )
@@ -58,9 +62,8 @@ class Settings(BaseSettings):
             raise ValueError("Must contain at least one value")
         if len(items) > 20:
             raise ValueError("Maximum 20 items allowed")
-        pattern = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]*$")
         for item in items:
-            if not pattern.match(item):
+            if not _NAME_PATTERN.match(item):
                 raise ValueError(
                     f"Invalid dimension/metric name: '{item}'"
                 )
@@ -89,7 +92,7 @@ class Settings(BaseSettings):
     @field_validator("output_prefix")
     @classmethod
     def validate_prefix(cls, v: str) -> str:
-        if not re.fullmatch(r"[a-zA-Z0-9_\-]+", v):
+        if not _PREFIX_PATTERN.fullmatch(v):
             raise ValueError(
                 "output_prefix must be alphanumeric with dashes/underscores"
             )
@@ -105,8 +108,10 @@ class Settings(BaseSettings):
             )
         return v
 
+    @cached_property
     def dimension_list(self) -> list[str]:
         return [d.strip() for d in self.dimensions.split(",")]
 
+    @cached_property
     def metric_list(self) -> list[str]:
         return [m.strip() for m in self.metrics.split(",")]
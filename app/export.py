@@ -3,37 +3,57 @@
 import csv
 import logging
 import os
+from collections.abc import Iterable
 from datetime import datetime, timezone
+from itertools import chain
 
 logger = logging.getLogger(__name__)
 
 
 def export_csv(
-    rows: list[dict],
+    rows: Iterable[dict],
     output_dir: str,
     prefix: str = "ga4_report",
     delimiter: str = ",",
 ) -> str:
-    """Write rows to a timestamped CSV file and return the filepath."""
+    """Write rows to a timestamped CSV file and return the filepath.
+
+    Accepts any iterable of dicts (including lazy iterators such as the one
+    from run_report) and streams rows to disk as they arrive; column order
+    comes from the first row's keys.
+    """
     os.makedirs(output_dir, exist_ok=True)
 
     timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
     filename = f"{prefix}_{timestamp}.csv"
     filepath = os.path.join(output_dir, filename)
 
-    if not rows:
+    iterator = iter(rows)
+    first = next(iterator, None)
+    if first is None:
         logger.warning("No rows to export")
         # Write an empty file with no headers
         with open(filepath, "w", newline="", encoding="utf-8") as f:
             f.write("")
         return filepath
 
-    fieldnames = list(rows[0].keys())
+    fieldnames = list(first.keys())
+    count = 0
+
+    # 1 MiB buffer so large exports coalesce into few write() syscalls;
+    # csv.writer with pre-built value lists avoids DictWriter's per-row
+    # fieldname lookups
+    with open(filepath, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(fieldnames)
+
+        def _value_rows():
+            nonlocal count
+            for row in chain([first], iterator):
+                count += 1
+                yield [row.get(field, "") for field in fieldnames]
 
-    with open(filepath, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter)
-        writer.writeheader()
-        writer.writerows(rows)
+        writer.writerows(_value_rows())
 
-    logger.info("Exported %d rows → %s", len(rows), filepath)
+    logger.info("Exported %d rows → %s", count, filepath)
     return filepath
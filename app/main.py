@@ -3,10 +3,12 @@
 import logging
 import sys
 
+from google.api_core.exceptions import GoogleAPICallError
+
 from app.auth import load_credentials
 from app.config import Settings
 from app.export import export_csv
-from app.report import run_report
+from app.report import DailyQuotaExceeded, get_client, run_report
 
 logging.basicConfig(
     level=logging.INFO,
@@ -44,29 +46,30 @@ def main() -> int:
         logger.debug("Detail: %s", exc)
         return EXIT_AUTH_ERROR
 
-    # --- Query ---
+    # --- Query + Export ---
+    # run_report yields lazily, so rows stream from the API straight into the
+    # CSV and query errors surface while the export consumes the iterator
     try:
+        client = get_client(creds)
         rows = run_report(
             credentials=creds,
+            client=client,
             property_id=settings.property_id,
             start_date=settings.start_date,
             end_date=settings.end_date,
-            dimensions=settings.dimension_list(),
-            metrics=settings.metric_list(),
+            dimensions=settings.dimension_list,
+            metrics=settings.metric_list,
         )
-    except Exception as exc:
-        logger.error("GA4 query error: %s", type(exc).__name__)
-        logger.debug("Detail: %s", exc)
-        return EXIT_QUERY_ERROR
-
-    # --- Export ---
-    try:
         filepath = export_csv(
             rows=rows,
             output_dir=settings.output_dir,
             prefix=settings.output_prefix,
             delimiter=settings.csv_delimiter,
         )
+    except (GoogleAPICallError, DailyQuotaExceeded) as exc:
+        logger.error("GA4 query error: %s", type(exc).__name__)
+        logger.debug("Detail: %s", exc)
+        return EXIT_QUERY_ERROR
     except Exception as exc:
         logger.error("CSV export error: %s", type(exc).__name__)
         logger.debug("Detail: %s", exc)
@@ -1,9 +1,16 @@
 """GA4 Data API query logic."""
 
+import atexit
 import logging
+import random
+import sys
+import threading
+import time
+from collections.abc import Iterator
 
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
     DateRange,
     Dimension,
     Filter,
@@ -11,6 +18,11 @@ from google.analytics.data_v1beta.types import (
     Metric,
     RunReportRequest,
 )
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    ResourceExhausted,
+    ServiceUnavailable,
+)
 from google.oauth2.credentials import Credentials
 
 logger = logging.getLogger(__name__)
@@ -18,6 +30,139 @@ logger = logging.getLogger(__name__)
 # GA4 API limit: max 10 metrics per request
 MAX_METRICS_PER_REQUEST = 10
 
+# GA4 API limit: max 5 report requests per batchRunReports call
+MAX_REQUESTS_PER_BATCH = 5
+
+# GA4 API limit: max 4 date ranges per report request
+MAX_DATE_RANGES_PER_REQUEST = 4
+
+# GA4 API limit: max rows returnable by a single report request; requested
+# explicitly because the server default (10,000) is shared across all date
+# ranges in a coalesced request
+MAX_ROWS_PER_REQUEST = 250_000
+
+# Rows fetched per runReport page; keeps peak memory at O(page) instead of
+# O(total rows) for large properties
+DEFAULT_PAGE_SIZE = 10_000
+
+# Retry policy for transient RPC errors
+MAX_RETRY_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 60
+PER_MINUTE_QUOTA_WAIT_SECONDS = 60.0
+
+# Pre-emptive throttle: pause before querying a property whose remaining
+# hourly quota tokens (reported when return_property_quota is set) have
+# dropped below this threshold
+LOW_QUOTA_TOKEN_THRESHOLD = 500
+LOW_QUOTA_PAUSE_SECONDS = 5.0
+
+_TRANSIENT_EXCEPTIONS = (ServiceUnavailable, DeadlineExceeded)
+
+# Remaining hourly tokens per property, updated from each response
+_quota_remaining: dict[str, int] = {}
+
+# One client per credentials object, shared across calls and threads; a
+# fresh client means a fresh gRPC channel + TLS handshake on every report
+_client_cache: dict[int, BetaAnalyticsDataClient] = {}
+_client_lock = threading.Lock()
+
+
+def get_client(credentials: Credentials) -> BetaAnalyticsDataClient:
+    """Return a cached client for these credentials, creating it on first use."""
+    key = id(credentials)
+    with _client_lock:
+        client = _client_cache.get(key)
+        if client is None:
+            client = BetaAnalyticsDataClient(credentials=credentials)
+            _client_cache[key] = client
+        return client
+
+
+def _close_clients() -> None:
+    """Close cached gRPC channels at interpreter exit."""
+    for client in _client_cache.values():
+        client.transport.close()
+
+
+atexit.register(_close_clients)
+
+
+class DailyQuotaExceeded(Exception):
+    """Raised when a property's daily GA4 quota is exhausted.
+
+    Not retryable within a run — callers should stop querying the property.
+    """
+
+    def __init__(self, property_id: str):
+        super().__init__(f"Daily GA4 quota exhausted for property {property_id}")
+        self.property_id = property_id
+
+
+def _call_with_retry(rpc, request, property_id: str, max_attempts: int = MAX_RETRY_ATTEMPTS):
+    """Invoke an RPC with quota-aware retries.
+
+    Daily quota exhaustion raises DailyQuotaExceeded immediately (a retry
+    cannot succeed until the quota resets); per-minute quota errors wait out
+    the window; 5xx/transient errors back off exponentially with jitter.
+    """
+    remaining = _quota_remaining.get(property_id)
+    if remaining is not None and remaining < LOW_QUOTA_TOKEN_THRESHOLD:
+        logger.warning(
+            "Property %s has only %d hourly quota tokens left — pausing %.0fs",
+            property_id,
+            remaining,
+            LOW_QUOTA_PAUSE_SECONDS,
+        )
+        time.sleep(LOW_QUOTA_PAUSE_SECONDS)
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return rpc(request)
+        except ResourceExhausted as exc:
+            message = str(exc).lower()
+            if "daily" in message or "per day" in message:
+                raise DailyQuotaExceeded(property_id) from exc
+            if attempt == max_attempts:
+                raise
+            if "minute" in message:
+                wait = PER_MINUTE_QUOTA_WAIT_SECONDS
+            else:
+                wait = min(MAX_BACKOFF_SECONDS, 2**attempt) + random.random()
+            logger.warning(
+                "Quota error on property %s (attempt %d/%d), waiting %.1fs: %s",
+                property_id,
+                attempt,
+                max_attempts,
+                wait,
+                exc,
+            )
+            time.sleep(wait)
+        except _TRANSIENT_EXCEPTIONS as exc:
+            if attempt == max_attempts:
+                raise
+            wait = min(MAX_BACKOFF_SECONDS, 2**attempt) + random.random()
+            logger.warning(
+                "Transient %s on property %s (attempt %d/%d), waiting %.1fs",
+                type(exc).__name__,
+                property_id,
+                attempt,
+                max_attempts,
+                wait,
+            )
+            time.sleep(wait)
+
+
+def _record_property_quota(property_id: str, response) -> None:
+    """Cache remaining hourly tokens from a response's property_quota."""
+    quota = getattr(response, "property_quota", None)
+    if quota and quota.tokens_per_hour:
+        _quota_remaining[property_id] = quota.tokens_per_hour.remaining
+
+
+def get_quota_remaining(property_id: str) -> int | None:
+    """Remaining hourly quota tokens for a property, or None if not yet seen."""
+    return _quota_remaining.get(property_id)
+
 
 def chunk_metrics(
     metrics: list[str], max_size: int = MAX_METRICS_PER_REQUEST
@@ -26,6 +171,88 @@ def chunk_metrics(
     return [metrics[i : i + max_size] for i in range(0, len(metrics), max_size)]
 
 
+def build_dimension_filter(dimension_filter: dict) -> FilterExpression:
+    """Build a FilterExpression proto from the dict form.
+
+    The dict has keys ``field``, ``match_type``, ``value``. Callers issuing
+    many requests with the same filter should build the proto once and pass
+    it through instead of the dict.
+    """
+    string_filter = Filter.StringFilter(
+        match_type=Filter.StringFilter.MatchType[dimension_filter["match_type"]],
+        value=dimension_filter["value"],
+    )
+    return FilterExpression(
+        filter=Filter(
+            field_name=dimension_filter["field"],
+            string_filter=string_filter,
+        )
+    )
+
+
+def build_report_request(
+    property_id: str,
+    date_ranges: list[dict],
+    dimensions: list[str],
+    metrics: list[str],
+    dimension_filter: dict | FilterExpression | None = None,
+) -> RunReportRequest:
+    """Build a RunReportRequest proto (shared by single and batch paths).
+
+    Args:
+        date_ranges: List of dicts with ``start_date``/``end_date`` and an
+            optional ``label`` used as the DateRange name. With more than one
+            range the response grows a ``dateRange`` column whose value is the
+            name of the range each row belongs to.
+        dimension_filter: Optional dimension filter, either the dict form
+            accepted by build_dimension_filter() or an already-built
+            FilterExpression (used as-is, no reconstruction).
+    """
+    if len(date_ranges) > MAX_DATE_RANGES_PER_REQUEST:
+        raise ValueError(
+            f"A report request accepts at most {MAX_DATE_RANGES_PER_REQUEST} "
+            f"date ranges, got {len(date_ranges)}"
+        )
+
+    ranges = []
+    for dr in date_ranges:
+        range_kwargs = {"start_date": dr["start_date"], "end_date": dr["end_date"]}
+        if dr.get("label"):
+            range_kwargs["name"] = dr["label"]
+        ranges.append(DateRange(**range_kwargs))
+
+    request_kwargs: dict = {
+        "property": f"properties/{property_id}",
+        "dimensions": [Dimension(name=d) for d in dimensions],
+        "metrics": [Metric(name=m) for m in metrics],
+        "date_ranges": ranges,
+        "limit": MAX_ROWS_PER_REQUEST,
+        "return_property_quota": True,
+    }
+
+    if dimension_filter:
+        if not isinstance(dimension_filter, FilterExpression):
+            dimension_filter = build_dimension_filter(dimension_filter)
+        request_kwargs["dimension_filter"] = dimension_filter
+
+    return RunReportRequest(**request_kwargs)
+
+
+def _rows_to_dicts(response, dimensions: list[str], metrics: list[str]) -> list[dict]:
+    """Convert a report response's rows into a list of flat dicts."""
+    # Interned names let the per-row dicts share key storage, and zip avoids
+    # per-cell enumerate/__getitem__ in the hot loop
+    dimensions = [sys.intern(d) for d in dimensions]
+    metrics = [sys.intern(m) for m in metrics]
+
+    results: list[dict] = []
+    for row in response.rows:
+        record = dict(zip(dimensions, (dv.value for dv in row.dimension_values)))
+        record.update(zip(metrics, (mv.value for mv in row.metric_values)))
+        results.append(record)
+    return results
+
+
 def run_report(
     credentials: Credentials,
     property_id: str,
@@ -35,36 +262,23 @@ def run_report(
     metrics: list[str],
     dimension_filter: dict | None = None,
     client: BetaAnalyticsDataClient | None = None,
-) -> list[dict]:
-    """Execute a GA4 report and return rows as a list of dicts.
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Iterator[dict]:
+    """Execute a GA4 report, yielding rows as dicts.
+
+    Pages through the result set page_size rows at a time, so consumers that
+    stream (e.g. export_csv) never hold more than one page in memory. The
+    query runs lazily — API errors surface when the iterator is consumed.
 
     Args:
         dimension_filter: Optional dict with keys ``field``, ``match_type``,
             ``value`` to apply a dimension filter to the query.
-        client: Optional pre-built client instance (avoids creating a new
-            one per call, useful for batch workloads).
+        client: Optional pre-built client instance; defaults to the cached
+            per-credentials client from get_client().
+        page_size: Rows per runReport page.
     """
     if client is None:
-        client = BetaAnalyticsDataClient(credentials=credentials)
-
-    request_kwargs: dict = {
-        "property": f"properties/{property_id}",
-        "dimensions": [Dimension(name=d) for d in dimensions],
-        "metrics": [Metric(name=m) for m in metrics],
-        "date_ranges": [DateRange(start_date=start_date, end_date=end_date)],
-    }
-
-    if dimension_filter:
-        string_filter = Filter.StringFilter(
-            match_type=Filter.StringFilter.MatchType[dimension_filter["match_type"]],
-            value=dimension_filter["value"],
-        )
-        request_kwargs["dimension_filter"] = FilterExpression(
-            filter=Filter(
-                field_name=dimension_filter["field"],
-                string_filter=string_filter,
-            )
-        )
+        client = get_client(credentials)
 
     logger.info(
         "Querying property %s  |  %s → %s  |  dims=%s  metrics=%s",
@@ -75,17 +289,80 @@ def run_report(
         metrics,
     )
 
-    request = RunReportRequest(**request_kwargs)
-    response = client.run_report(request)
+    request = build_report_request(
+        property_id=property_id,
+        date_ranges=[{"start_date": start_date, "end_date": end_date}],
+        dimensions=dimensions,
+        metrics=metrics,
+        dimension_filter=dimension_filter,
+    )
+    request.limit = page_size
 
-    results: list[dict] = []
-    for row in response.rows:
-        record: dict = {}
-        for i, dim in enumerate(dimensions):
-            record[dim] = row.dimension_values[i].value
-        for i, met in enumerate(metrics):
-            record[met] = row.metric_values[i].value
-        results.append(record)
+    offset = 0
+    total = 0
+    while True:
+        request.offset = offset
+        response = _call_with_retry(client.run_report, request, property_id)
+        _record_property_quota(property_id, response)
+
+        page = _rows_to_dicts(response, dimensions, metrics)
+        total += len(page)
+        yield from page
 
-    logger.info("Retrieved %d rows", len(results))
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+    logger.info("Retrieved %d rows", total)
+
+
+def run_report_batch(
+    client: BetaAnalyticsDataClient,
+    property_id: str,
+    requests: list[RunReportRequest],
+) -> list[list[dict]]:
+    """Execute up to MAX_REQUESTS_PER_BATCH reports in one batchRunReports call.
+
+    Returns one row list per request, in request order. All requests must
+    target the same property (a batchRunReports constraint).
+    """
+    if len(requests) > MAX_REQUESTS_PER_BATCH:
+        raise ValueError(
+            f"batchRunReports accepts at most {MAX_REQUESTS_PER_BATCH} requests, "
+            f"got {len(requests)}"
+        )
+
+    logger.info(
+        "Batch querying property %s  |  %d report(s) in one call",
+        property_id,
+        len(requests),
+    )
+
+    batch_request = BatchRunReportsRequest(
+        property=f"properties/{property_id}",
+        requests=requests,
+    )
+    response = _call_with_retry(client.batch_run_reports, batch_request, property_id)
+
+    results: list[list[dict]] = []
+    for report in response.reports:
+        # Headers, not the request, are authoritative: multi-range requests
+        # gain an implicit dateRange column in the response
+        dims = [h.name for h in report.dimension_headers]
+        mets = [h.name for h in report.metric_headers]
+        _record_property_quota(property_id, report)
+        if report.row_count > len(report.rows):
+            logger.warning(
+                "Property %s: report truncated (%d of %d rows returned)",
+                property_id,
+                len(report.rows),
+                report.row_count,
+            )
+        results.append(_rows_to_dicts(report, dims, mets))
+
+    logger.info(
+        "Retrieved %d reports (%d rows total)",
+        len(results),
+        sum(len(r) for r in results),
+    )
     return results
@@ -89,6 +89,10 @@ def main() -> int:
         "client_secret": creds.client_secret,
         "scopes": list(creds.scopes or []),
     }
+    if creds.expiry:
+        # Persisting expiry lets app.auth skip the refresh round trip while
+        # the token still has life left
+        token_data["expiry"] = creds.expiry.isoformat() + "Z"
 
     os.makedirs(os.path.dirname(args.token_output), exist_ok=True)
     with open(args.token_output, "w") as f: